@@ -3,7 +3,10 @@ This script performs data visualisations on the data stored in the MongoDB datab
 """
 
 import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 import pandas as pd
+import matplotlib
 import matplotlib.pyplot as plt
 import math as m
 import numpy as np
@@ -11,6 +14,16 @@ from pymongo.database import Database
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
 
+# Render with the non-interactive Agg backend and let it simplify dense paths
+matplotlib.use('Agg')
+plt.rcParams['path.simplify'] = True
+plt.rcParams['path.simplify_threshold'] = 1.0
+
+# Define constants
+READ_BATCH_SIZE = 10_000
+SCATTER_SAMPLE_SIZE = 50_000
+PLOT_COLUMNS = ['DATETIME', 'state', 'TOTALDEMAND', 'TEMPERATURE', 'is_weekday', 'is_public_holiday', 'is_daylight']
+
 class DataVisualisations:
     """The DataVisualisations class contains methods for visualising data
     """
@@ -28,6 +41,17 @@ class DataVisualisations:
         self.target_directory = target_directory
         self.source_data = source_data
         
+    def __getstate__(self) -> dict:
+        """Excludes the MongoDB connection when the object is pickled for a worker process
+
+        Returns:
+            dict: The picklable attributes of the object
+        """
+        state = self.__dict__.copy()
+        state['client'] = None
+        state['db'] = None
+        return state
+        
     def mongo_client(self, url: str) -> MongoClient:
         """Establishes a connection to a MongoDB client
 
@@ -58,25 +82,26 @@ class DataVisualisations:
         """Closes the connection to the MongoDB client"""
         self.client.close()
     
-    def read_mongo_data(self, collection_name: str) -> pd.DataFrame:
+    def read_mongo_data(self, collection_name: str, columns: list) -> pd.DataFrame:
         """Reads data from a MongoDB collection into a pandas DataFrame
 
         Args:
             collection_name (str): The name of the collection to read from
+            columns (list): The fields to read from each document
 
         Returns:
             pd.DataFrame: The data from the collection as a DataFrame
         """
-        # Query all documents in the collection
-        data = self.db[collection_name].find()
+        # Query all documents in the collection, only sending the requested fields from the server
+        projection = {'_id': False, **{col: True for col in columns}}
+        cursor = self.db[collection_name].find({}, projection=projection).batch_size(READ_BATCH_SIZE)
 
-        # Convert to pandas DataFrame
-        df = pd.DataFrame(list(data))
+        # Convert the documents to pandas DataFrames one batch at a time
+        chunks = []
+        while batch := list(islice(cursor, READ_BATCH_SIZE)):
+            chunks.append(pd.DataFrame.from_records(batch, columns=columns))
 
-        # Optional: If you don't want the MongoDB '_id' in your DataFrame
-        df.drop('_id', axis=1, inplace=True)
-
-        return df
+        return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=columns)
     
     def generate_histograms(self, df: pd.DataFrame) -> None:
         """Generates histograms for TOTALDEMAND and TEMPERATURE
@@ -90,43 +115,48 @@ class DataVisualisations:
             'TEMPERATURE': 'Temperature'
         }
         
-        # Extract unique states from the DataFrame
-        states = df['state'].unique()
+        # Split the DataFrame by state once, rather than filtering it for every plot
+        state_groups = list(df.groupby('state', sort=False))
         
-        for variable, pretty_name in variables.items():
-            # Determine number of rows needed for the subplot grid, always 2 columns
-            num_rows = m.ceil(len(states) / 2)
-
-            # Create subplot
-            axs = plt.subplots(num_rows, 2, figsize=(10, 5 * num_rows))[1]
+        # Determine number of rows needed for the subplot grid, always 2 columns
+        num_rows = m.ceil(len(state_groups) / 2)
 
-            # Flatten the axes array for easier iteration
-            axs = axs.ravel()
+        # Create the subplot once and reuse it for every variable
+        fig, axs = plt.subplots(num_rows, 2, figsize=(10, 5 * num_rows))
 
-            for i, state in enumerate(states):
-                # Filter the DataFrame for the state and plot the histogram for the specified variable
-                state_data = df[df['state'] == state]
-                axs[i].hist(state_data[variable], bins=100, color='blue' if variable == 'TOTALDEMAND' else 'green', alpha=0.7)
+        # Flatten the axes array for easier iteration
+        axs = axs.ravel()
+        
+        for variable, pretty_name in variables.items():
+            for i, (state, state_data) in enumerate(state_groups):
+                # Clear the previous variable and plot the histogram for the specified variable, binning each state over
+                # its own range as the axes are not shared
+                axs[i].clear()
+                counts, bin_edges = np.histogram(state_data[variable].to_numpy(), bins=100)
+                axs[i].bar(
+                    bin_edges[:-1], counts, width=np.diff(bin_edges), align='edge',
+                    color='blue' if variable == 'TOTALDEMAND' else 'green', alpha=0.7
+                )
                 axs[i].set_title(f'{pretty_name} Distribution in {state}')
                 axs[i].set_xlabel(pretty_name)
                 axs[i].set_ylabel('Frequency')
             
             # If there are odd number of states, turn off the last ax if unused
-            if len(states) % 2 != 0:
+            if len(state_groups) % 2 != 0:
                 axs[-1].axis('off')
 
             # Adjust layout to prevent overlap
-            plt.tight_layout()
+            fig.tight_layout()
 
             # Check if the directory exists, and if not, create it
             if not os.path.exists(self.target_directory):
                 os.makedirs(self.target_directory)
 
             # Save the plot to a PDF file for the specific variable
-            plt.savefig(f'{self.target_directory}/{pretty_name.replace(" ", "_").lower()}_distribution.pdf')
+            fig.savefig(f'{self.target_directory}/{pretty_name.replace(" ", "_").lower()}_distribution.pdf')
 
-            # Close the plot to free up memory
-            plt.close()
+        # Close the plot to free up memory
+        plt.close(fig)
             
     def generate_scatter_plots(self, df: pd.DataFrame) -> None:
         """Generates scatter plots of Total Demand vs Temperature with a quadratic fit line
@@ -134,53 +164,59 @@ class DataVisualisations:
         Args:
             df (pd.DataFrame): The data to visualize
         """
-        # Extract unique states from the DataFrame
-        states = df['state'].unique()
+        # Split the DataFrame by state once, rather than filtering it for every plot
+        state_groups = list(df.groupby('state', sort=False))
 
         # Determine number of rows needed for the subplot grid, always 2 columns
-        num_rows = m.ceil(len(states) / 2)
+        num_rows = m.ceil(len(state_groups) / 2)
 
         # Create subplot
-        axs = plt.subplots(num_rows, 2, figsize=(10, 5 * num_rows))[1]
+        fig, axs = plt.subplots(num_rows, 2, figsize=(10, 5 * num_rows))
         
         # Flatten the axes array for easier iteration
         axs = axs.ravel()
 
-        for i, state in enumerate(states):
-            # Filter the DataFrame for the state
-            state_data = df[df['state'] == state]
-            x = state_data['TEMPERATURE']
-            y = state_data['TOTALDEMAND']
+        # Seed the point sampling so the plot is reproducible
+        rng = np.random.default_rng(0)
 
-            # Fit a quadratic curve
-            coefficients = np.polyfit(x, y, 2)  # 2 for quadratic
-            polynomial = np.poly1d(coefficients)
-            x_line = np.linspace(min(x), max(x), 100)
-            y_line = polynomial(x_line)
+        for i, (state, state_data) in enumerate(state_groups):
+            x = state_data['TEMPERATURE'].to_numpy(dtype=np.float64)
+            y = state_data['TOTALDEMAND'].to_numpy(dtype=np.float64)
+
+            # Fit a quadratic curve in float64, as float32 truncates the ill-conditioned fit on this many points.
+            # Coefficients are returned lowest order first
+            c0, c1, c2 = np.polynomial.polynomial.polyfit(x, y, 2)
+            x_line = np.linspace(x.min(), x.max(), 100)
+            y_line = c0 + x_line * (c1 + c2 * x_line)
+
+            # Only draw a random sample of the points, which looks the same at this size
+            sample = rng.choice(len(x), size=min(len(x), SCATTER_SAMPLE_SIZE), replace=False)
 
             # Plotting the scatter plot and the quadratic fit line
-            axs[i].scatter(x, y, color='blue', alpha=0.3, s=10)
+            axs[i].scatter(
+                x[sample].astype(np.float32), y[sample].astype(np.float32), color='blue', alpha=0.3, s=10
+            )
             axs[i].plot(x_line, y_line, color='red')
             axs[i].set_title(f'Total Demand vs Temperature in {state}')
             axs[i].set_xlabel('Temperature')
             axs[i].set_ylabel('Total Demand')
 
         # Handle any unused subplots in case of an odd number of states
-        if len(states) % 2 != 0:
+        if len(state_groups) % 2 != 0:
             axs[-1].axis('off')
         
         # Adjust layout to prevent overlap
-        plt.tight_layout()
+        fig.tight_layout()
 
         # Check if the directory exists, and if not, create it
         if not os.path.exists(self.target_directory):
             os.makedirs(self.target_directory)
 
         # Save the plot to a PDF file
-        plt.savefig(f'{self.target_directory}/demand_vs_temperature_scatter.png')
+        fig.savefig(f'{self.target_directory}/demand_vs_temperature_scatter.png')
 
         # Close the plot to free up memory
-        plt.close()
+        plt.close(fig)
         
     def generate_tufte_plots(self, df: pd.DataFrame):
         """Generates Tufte-style plots for predefined data categorizations.
@@ -202,30 +238,38 @@ class DataVisualisations:
             {'column_name': 'is_daylight', 'labels': ['Day', 'Night'], 'column_is_date': False}
         ]
 
+        # Create the plot once and reuse it for every configuration
+        fig, ax = plt.subplots(figsize=(10, 5))
+
+        # Access the datetime properties once and share them between the date configurations
+        dt = df['DATETIME'].dt
+
         for config in configurations:
             column_name = config['column_name']
             labels = config['labels']
             column_is_date = config.get('column_is_date', False)
 
-            # Convert column to month or weekday name if required
+            # Convert column to month or weekday categories if required, stored as integer codes
             if column_is_date:
                 if 'month' == column_name:
-                    df[column_name] = df['DATETIME'].dt.month_name()
+                    codes = dt.month.to_numpy() - 1
+                    df[column_name] = pd.Categorical.from_codes(codes, categories=labels, ordered=True)
                 elif 'day_of_week' == column_name:
-                    df[column_name] = df['DATETIME'].dt.day_name()
+                    codes = dt.dayofweek.to_numpy()
+                    df[column_name] = pd.Categorical.from_codes(codes, categories=labels, ordered=True)
 
             # Map boolean values to descriptive labels if necessary
             if not column_is_date:
                 df[column_name] = df[column_name].map({True: labels[0], False: labels[1]})
 
             # Group data by the specified column and collect 'TOTALDEMAND' in lists
-            data = df.groupby(column_name)['TOTALDEMAND'].apply(list).reindex(labels)
+            data = df.groupby(column_name, observed=False)['TOTALDEMAND'].apply(list).reindex(labels)
 
             # Calculate medians for each group
             medians = data.apply(np.median)
 
-            # Create plot
-            ax = plt.subplots(figsize=(10, 5))[1]
+            # Clear the previous configuration and create plot
+            ax.clear()
             ax.boxplot(
                 x=data.tolist(), vert=False, showbox=False,
                 medianprops={'linewidth': 0}, whis=5, showcaps=False,
@@ -244,17 +288,17 @@ class DataVisualisations:
             ax.tick_params(axis='y', which='major', left=False)
             ax.grid(True, linestyle='--', linewidth=0.5, axis='x')
 
-            plt.tight_layout()  # Ensure nothing is cut off
+            fig.tight_layout()  # Ensure nothing is cut off
 
             # Check if the directory exists, and if not, create it
             if not os.path.exists(self.target_directory):
                 os.makedirs(self.target_directory)
 
             # Save the plot to a file
-            plt.savefig(f'{self.target_directory}/tufte_plot_{column_name}.pdf')
+            fig.savefig(f'{self.target_directory}/tufte_plot_{column_name}.pdf')
 
-            # Close the plot to free up memory
-            plt.close()
+        # Close the plot to free up memory
+        plt.close(fig)
 
     def run(self):
         """Runs the feature engineering pipeline
@@ -265,16 +309,22 @@ class DataVisualisations:
                 features = pd.read_csv("/Users/dsartor/Repos/uni/Team-K---ZZSC9020-Capstone-Project/data/modelling_data.csv")
                 print(f"Read data from {self.source_data}")
             else:
-                features = self.read_mongo_data(self.feature_collection_name)
-            
-            # Generate histograms of demand data
-            self.generate_histograms(features)
-            
-            # Generate scatter plots of demand vs temperature data
-            self.generate_scatter_plots(features)
+                features = self.read_mongo_data(self.feature_collection_name, PLOT_COLUMNS)
             
-            # Generate a Tufte-style plot of demand by day of the week
-            self.generate_tufte_plots(features)
+            # The plots are independent, so generate them in separate processes
+            with ProcessPoolExecutor(max_workers=3) as executor:
+                futures = [
+                    # Generate histograms of demand data
+                    executor.submit(self.generate_histograms, features),
+                    # Generate scatter plots of demand vs temperature data
+                    executor.submit(self.generate_scatter_plots, features),
+                    # Generate a Tufte-style plot of demand by day of the week
+                    executor.submit(self.generate_tufte_plots, features),
+                ]
+                
+                # Wait for every plot, raising any error from the worker processes
+                for future in futures:
+                    future.result()
             
         except Exception as e:
             print(f"An error occurred: {e}")
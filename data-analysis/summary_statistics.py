@@ -10,37 +10,61 @@ def connect_to_mongo():
     client = MongoClient(url, server_api=ServerApi(version='1'))
     return client
 
-def fetch_data(client, db_name, collection_name):
-    db = client[db_name]
-    collection = db[collection_name]
-    data = collection.find()
-    df = pd.DataFrame(list(data))
-    df.drop('_id', axis=1, inplace=True)
-    return df
-
-def analyze_data(df, datetime_col, state_col, value_col):
+def is_null(col):
+    return {'$in': [{'$ifNull': [f'${col}', None]}, [None, float('nan')]]}
+
+def value_or_null(col):
+    # Replace NaN with null so the accumulators skip it, as pandas does
+    return {'$cond': [is_null(col), None, f'${col}']}
+
+def field_names(collection):
+    # Collect the fields present in any document, not just the first
+    pipeline = [
+        {'$project': {'fields': {'$objectToArray': '$$ROOT'}}},
+        {'$unwind': '$fields'},
+        {'$match': {'fields.k': {'$ne': '_id'}}},
+        {'$group': {'_id': '$fields.k'}},
+        {'$sort': {'_id': 1}}
+    ]
+    return [doc['_id'] for doc in collection.aggregate(pipeline, allowDiskUse=True)]
+
+def analyze_data(collection, datetime_col, state_col, value_col):
+    # Compute the statistics server side so only the aggregate result is sent back
+    columns = field_names(collection)
+    pipeline = [{'$group': {
+        '_id': None,
+        'count': {'$sum': 1},
+        'max_datetime': {'$max': f'${datetime_col}'},
+        'min_datetime': {'$min': f'${datetime_col}'},
+        'max_value': {'$max': value_or_null(value_col)},
+        'min_value': {'$min': value_or_null(value_col)},
+        'mean_value': {'$avg': value_or_null(value_col)},
+        'std_dev_value': {'$stdDevSamp': value_or_null(value_col)},
+        **{f'nulls_{i}': {'$sum': {'$cond': [is_null(col), 1, 0]}} for i, col in enumerate(columns)}
+    }}]
+    result = next(collection.aggregate(pipeline), {})
+    nulls_per_column = pd.Series({col: result.get(f'nulls_{i}', 0) for i, col in enumerate(columns)}, dtype='int64')
     analysis = {
-        'max_datetime': df[datetime_col].max(),
-        'min_datetime': df[datetime_col].min(),
-        'unique_states': df[state_col].unique(),
-        'max_value': df[value_col].max(),
-        'min_value': df[value_col].min(),
-        'mean_value': df[value_col].mean(),
-        'std_dev_value': df[value_col].std(),
-        'nulls_per_column': df.isna().sum(),
-        'not_nulls_per_column': df.notna().sum()
+        'max_datetime': result.get('max_datetime'),
+        'min_datetime': result.get('min_datetime'),
+        'unique_states': collection.distinct(state_col),
+        'max_value': result.get('max_value'),
+        'min_value': result.get('min_value'),
+        'mean_value': result.get('mean_value'),
+        'std_dev_value': result.get('std_dev_value'),
+        'nulls_per_column': nulls_per_column,
+        'not_nulls_per_column': result.get('count', 0) - nulls_per_column
     }
-    if 'LOCATION' in df.columns:  # Specific to 'temperature' collection
-        analysis['unique_locations'] = df['LOCATION'].unique()
+    if 'LOCATION' in columns:  # Specific to 'temperature' collection
+        analysis['unique_locations'] = collection.distinct('LOCATION')
     return analysis
 
 def main():
     client = connect_to_mongo()
-    total_demand_df = fetch_data(client, 'data', 'total_demand')
-    temperature_df = fetch_data(client, 'data', 'temperature')
+    db = client['data']
 
-    total_demand_analysis = analyze_data(total_demand_df, 'DATETIME', 'state', 'TOTALDEMAND')
-    temperature_analysis = analyze_data(temperature_df, 'DATETIME', 'state', 'TEMPERATURE')
+    total_demand_analysis = analyze_data(db['total_demand'], 'DATETIME', 'state', 'TOTALDEMAND')
+    temperature_analysis = analyze_data(db['temperature'], 'DATETIME', 'state', 'TEMPERATURE')
 
     print("Total Demand Collection Analysis:")
     print(total_demand_analysis)
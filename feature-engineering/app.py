@@ -3,26 +3,31 @@ This script performs feature engineering on the demand and temperature data from
 """
 
 import os
-from datetime import datetime, timedelta
-import math as m
-import holidays
+from datetime import timedelta
+from itertools import islice
+import joblib
+import numpy as np
 import pandas as pd
-import pytz
-from astral import LocationInfo
-from astral.sun import sun
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
 from pymongo.database import Database
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
-from sklearn.experimental import enable_iterative_imputer # noqa
-from sklearn.impute import IterativeImputer
+import daylight
+import public_holidays
 
 # Define constants
-STATE_TIMEZONES = {
-    'NSW': 'Australia/Sydney',
-    'QLD': 'Australia/Brisbane',
-    'SA': 'Australia/Adelaide',
-    'VIC': 'Australia/Melbourne',
+READ_BATCH_SIZE = 10_000
+INSERT_BATCH_SIZE = 10_000
+PARQUET_ROW_GROUP_SIZE = 200_000
+COLUMN_TYPES = {
+    'DATETIME': pa.timestamp('ns'),
+    'state': pa.string(),
+    'TOTALDEMAND': pa.float64(),
+    'TEMPERATURE': pa.float64(),
 }
+STATE_DTYPE = pd.CategoricalDtype(categories=['NSW', 'QLD', 'SA', 'VIC'])
 
 
 class FeatureEngineering:
@@ -35,7 +40,8 @@ class FeatureEngineering:
         demand_collection_name: str,
         temperature_collection_name: str,
         target_collection_name: str,
-        local_output_path: str = None
+        local_output_path: str = None,
+        cache_directory: str = None
     ) -> None:
         self.client = self.mongo_client(url)
         self.db = self.mongo_database(db_name)
@@ -43,6 +49,7 @@ class FeatureEngineering:
         self.temperature_collection_name = temperature_collection_name
         self.target_collection_name = target_collection_name
         self.local_output_path = local_output_path
+        self.memory = joblib.Memory(cache_directory, verbose=0)
         
     def mongo_client(self, url: str) -> MongoClient:
         """Establishes a connection to a MongoDB client
@@ -90,60 +97,108 @@ class FeatureEngineering:
         """
         return collection_name in self.db.list_collection_names()
     
-    def read_mongo_data(self, collection_name: str) -> pd.DataFrame:
-        """Reads data from a MongoDB collection into a pandas DataFrame
+    def create_datetime_index(self, collection_name: str) -> None:
+        """Creates an index on 'DATETIME' and 'state' in a collection, if it does not already exist
 
         Args:
-            collection_name (str): The name of the collection to read from
+            collection_name (str): The name of the collection to index
+        """
+        self.db[collection_name].create_index([('DATETIME', 1), ('state', 1)])
+    
+    def collection_version(self, collection_name: str) -> tuple:
+        """Identifies the current contents of a collection so cached reads of it can be reused
+
+        Args:
+            collection_name (str): The name of the collection to identify
 
         Returns:
-            pd.DataFrame: The data from the collection as a DataFrame
+            tuple: The database name, document count and latest 'DATETIME' in the collection
         """
-        # Query all documents in the collection
-        data = self.db[collection_name].find()
-
-        # Convert to pandas DataFrame
-        df = pd.DataFrame(list(data))
+        collection = self.db[collection_name]
+        latest = collection.find_one({}, projection={'_id': False, 'DATETIME': True}, sort=[('DATETIME', -1)])
+        return self.db.name, collection.estimated_document_count(), (latest or {}).get('DATETIME')
 
-        # Optional: If you don't want the MongoDB '_id' in your DataFrame
-        df.drop('_id', axis=1, inplace=True)
+    def read_demand_with_temperature(
+        self, demand_collection_name: str, temperature_collection_name: str, version: tuple = None
+    ) -> pd.DataFrame:
+        """Reads the demand data left joined with the average temperature for each state and datetime, joined by MongoDB
 
-        return df
+        Args:
+            demand_collection_name (str): The name of the demand collection to read from
+            temperature_collection_name (str): The name of the temperature collection to join from
+            version (tuple, optional): The collection versions, only used to key the cache
 
-    def is_public_holiday(self, date: datetime, state: str) -> bool:
-        """Determines if a given date is a public holiday in a given state
+        Returns:
+            pd.DataFrame: The demand and average temperature for each state and datetime
+        """
+        # Look up the temperatures at each demand reading's 'DATETIME' on the server, using the index on the temperature collection
+        pipeline = [
+            {'$lookup': {
+                'from': temperature_collection_name,
+                'localField': 'DATETIME',
+                'foreignField': 'DATETIME',
+                'as': 'temperature'
+            }},
+            # Keep the readings for the same state, then average them across locations, leaving null where there are
+            # none to match a left join
+            {'$project': {
+                '_id': False,
+                'DATETIME': True,
+                'state': True,
+                'TOTALDEMAND': True,
+                'TEMPERATURE': {'$map': {
+                    'input': {'$filter': {
+                        'input': '$temperature',
+                        'as': 'reading',
+                        'cond': {'$eq': ['$$reading.state', '$state']}
+                    }},
+                    'as': 'reading',
+                    'in': '$$reading.TEMPERATURE'
+                }}
+            }},
+            {'$addFields': {'TEMPERATURE': {'$avg': '$TEMPERATURE'}}}
+        ]
+        cursor = self.db[demand_collection_name].aggregate(pipeline, allowDiskUse=True, batchSize=READ_BATCH_SIZE)
+
+        return self.cursor_to_dataframe(cursor, ['DATETIME', 'state', 'TOTALDEMAND', 'TEMPERATURE'])
+
+    def cursor_to_dataframe(self, cursor, columns: list) -> pd.DataFrame:
+        """Converts the documents from a MongoDB cursor into a pandas DataFrame one batch at a time
 
         Args:
-            date (datetime): The date to check
-            state (str): The Australian state to check
+            cursor (Cursor): The cursor to read documents from
+            columns (list): The fields to read from each document
 
         Returns:
-            bool: Indicates if the date is a public holiday
+            pd.DataFrame: The documents as a DataFrame
         """
-        au_holidays = holidays.AU(prov=state)
-        return date in au_holidays
+        # Convert each batch straight into typed Arrow columns so datetimes never become Python objects
+        schema = pa.schema([(col, COLUMN_TYPES[col]) for col in columns])
+        tables = []
+        while batch := list(islice(cursor, READ_BATCH_SIZE)):
+            tables.append(pa.Table.from_pylist(batch, schema=schema))
 
-    def is_daylight(self, utc_datetime: datetime, state: str) -> bool:
-        """Determines if a given datetime is during daylight hours in a given Australian state
+        # Combine the batches and convert them to pandas once
+        table = pa.concat_tables(tables) if tables else schema.empty_table()
+        return table.to_pandas()
 
-        Args:
-            utc_datetime (datetime): The datetime to check
-            state (str): The Australian state to check
+    def insert_dataframe(self, collection_name: str, df: pd.DataFrame) -> None:
+        """Inserts the rows of a DataFrame into a MongoDB collection in unordered batches
 
-        Returns:
-            bool: Indicates if the datetime is during daylight hours
+        Args:
+            collection_name (str): The name of the collection to insert into
+            df (pd.DataFrame): The data to insert
         """
-        # Convert UTC datetime to local datetime
-        local_timezone = pytz.timezone(STATE_TIMEZONES[state])
-        local_datetime = utc_datetime.replace(tzinfo=pytz.utc).astimezone(local_timezone)
+        # Build the documents lazily from the rows so only one batch of them exists at a time
+        columns = df.columns.tolist()
+        records = (dict(zip(columns, row)) for row in df.itertuples(index=False, name=None))
+
+        # Unordered inserts let MongoDB apply each batch without stopping at the first error
+        while batch := list(islice(records, INSERT_BATCH_SIZE)):
+            self.db[collection_name].insert_many(batch, ordered=False)
 
-        city_info = LocationInfo(timezone=STATE_TIMEZONES[state])
-        s = sun(city_info.observer, date=local_datetime, tzinfo=local_timezone)
-        
-        return  not (s['sunset'] < local_datetime < s['sunrise'])
-    
     def impute_missing_values(self, df: pd.DataFrame) -> pd.DataFrame:
-        """Imputes missing values in a DataFrame using an iterative imputer
+        """Imputes missing values in a DataFrame by interpolating over time within each state
 
         Args:
             df (pd.DataFrame): The DataFrame to impute missing values in
@@ -151,31 +206,69 @@ class FeatureEngineering:
         Returns:
             pd.DataFrame: The DataFrame with imputed missing values
         """
-        imputer_input = df.drop(['state', 'DATETIME'], axis=1)
-
-        # Initialize the imputer
-        imputer = IterativeImputer(max_iter=10, random_state=0)
+        # Only the numeric columns that actually have gaps need to be interpolated
+        numeric_columns = df.select_dtypes(include='number').columns
+        missing_columns = numeric_columns[df[numeric_columns].isna().any().to_numpy()]
+
+        # Order each state's readings by time, returning straight away if there is nothing to interpolate
+        df = df.sort_values(['state', 'DATETIME'], ignore_index=True)
+        if len(missing_columns) == 0:
+            return df
+
+        # Interpolate the missing values against time, extending the nearest value over gaps at either end of the series
+        df = df.set_index('DATETIME')
+        df[missing_columns] = df.groupby('state', observed=True)[missing_columns].transform(
+            lambda group: group.interpolate(method='time', limit_direction='both')
+        )
+
+        return df.reset_index()
+    
+    def transform_periodic_values(self, values: np.ndarray, period: int) -> np.ndarray:
+        """Transforms periodic values using a sine function
 
-        # Impute the missing values
-        df_imputed = pd.DataFrame(imputer.fit_transform(imputer_input), columns=imputer_input.columns)
-        
-        # Add the 'state' and 'DATETIME' columns back to the DataFrame
-        df_imputed['state'] = df['state']
-        df_imputed['DATETIME'] = df['DATETIME']
+        Args:
+            values (np.ndarray): The values to transform
+            period (int): The period of the sine function
 
-        return df_imputed
+        Returns:
+            np.ndarray: The transformed values
+        """
+        return np.sin(2 * np.pi * values / period).astype(np.float32)
     
-    def transform_periodic_values(self, value: int, period: int) -> float:
-        """Transforms a periodic value using a sine function
+    def build_features(self, df: pd.DataFrame) -> dict:
+        """Builds the calendar, holiday and daylight features from the 'DATETIME' and 'state' columns
 
         Args:
-            value (int): The value to transform
-            period (int): The period of the sine function
+            df (pd.DataFrame): The DataFrame to build the features from
 
         Returns:
-            float: The transformed value
+            dict: The feature arrays keyed by column name
         """
-        return m.sin(2 * m.pi * value / period)
+        # Break the datetimes down into their components using NumPy datetime arithmetic
+        datetimes = df['DATETIME'].to_numpy(dtype='datetime64[ns]')
+        days = datetimes.astype('datetime64[D]')
+        months = datetimes.astype('datetime64[M]')
+        hour = datetimes.astype('datetime64[h]').astype(np.int64) % 24
+        minute = datetimes.astype('datetime64[m]').astype(np.int64) % 60
+
+        # The epoch (1970-01-01) was a Thursday, so offset by three days to count from Monday. The
+        # integer day of week is kept as int8 and shared by is_weekday and the sine encoding
+        day_of_week = ((days.astype(np.int64) + 3) % 7).astype(np.int8)
+
+        return {
+            'year': (datetimes.astype('datetime64[Y]').astype(np.int64) + 1970).astype(np.int16),
+            'month': self.transform_periodic_values(months.astype(np.int64) % 12 + 1, 12),
+            'day_of_month': ((days - months).astype(np.int64) + 1).astype(np.int8),
+            'day_of_week': self.transform_periodic_values(day_of_week, 7),
+            'is_weekday': day_of_week < 5,
+            'period_of_day': self.transform_periodic_values(hour * 2 + minute // 30, 48),
+            'is_public_holiday': self.memory.cache(public_holidays.compute_is_public_holiday)(
+                df['DATETIME'], df['state'], public_holidays.SOURCE_VERSION
+            ),
+            'is_daylight': self.memory.cache(daylight.compute_is_daylight)(
+                df['DATETIME'], df['state'], daylight.SOURCE_VERSION
+            ),
+        }
     
     def add_lagged_features(self, df: pd.DataFrame) -> pd.DataFrame:
         """
@@ -187,81 +280,105 @@ class FeatureEngineering:
         Returns:
             pd.DataFrame: The DataFrame with added lagged features.
         """
-        # Make sure df is sorted by 'state' and 'DATETIME' to ensure logical shifts
-        df = df.sort_values(by=['state', 'DATETIME'])
-
         # Specify the columns for which to create lagged versions, excluding 'state'
         lag_columns = ['year', 'month', 'day_of_month', 'day_of_week', 'TOTALDEMAND']
-        
-        # Initial DataFrame to join lagged features onto
-        df_final = df.copy()
-        
+
+        # Index the rows by 'state' and 'DATETIME' once and reuse it for every lag, keeping the first row of any duplicate
+        keys = pd.MultiIndex.from_arrays([df['state'], df['DATETIME']])
+        is_first = ~keys.duplicated()
+        lookup = keys[is_first]
+        rows = np.flatnonzero(is_first)
+
+        # Take the lagged values straight from each column's array. Rows are matched by key rather than position, so the
+        # DataFrame does not need to be sorted or copied first. The measurements keep their own precision, and the integer
+        # calendar columns are widened to float32 so missing lags can be marked with NaN
+        values = {
+            col: df[col].to_numpy() if np.issubdtype(df[col].dtype, np.floating) else df[col].to_numpy(dtype=np.float32)
+            for col in lag_columns
+        }
+        lagged = {}
+
         for hours in [1, 24]:
-            # Copy relevant columns, including 'state' for merging
-            hours_ahead = df[['state', 'DATETIME'] + lag_columns].copy()
-            
-            # Adjust 'DATETIME' for the lag and rename columns to indicate the lag
-            hours_ahead['DATETIME'] -= timedelta(hours=hours)
-            col_rename = {col: f'h{hours}_{col}' for col in lag_columns}  # Create renaming dictionary
-            hours_ahead.rename(columns=col_rename, inplace=True)
-            
-            # Define columns to merge (exclude original lag_columns from 'df', include only new lagged columns)
-            cols_to_merge = ['state', 'DATETIME'] + [f'h{hours}_{col}' for col in lag_columns]
-            
-            # Merge the lagged columns based on 'state' and 'DATETIME'
-            df_final = pd.merge(df_final, hours_ahead[cols_to_merge], on=['state', 'DATETIME'], how='left')
+            # Find the row for the same state the given number of hours ahead, if there is one
+            positions = lookup.get_indexer(pd.MultiIndex.from_arrays([df['state'], df['DATETIME'] + timedelta(hours=hours)]))
+            is_missing = positions < 0
+            source_rows = rows[positions]
+
+            for col in lag_columns:
+                column = values[col][source_rows]
+                column[is_missing] = np.nan
+                lagged[f'h{hours}_{col}'] = column
 
-        return df_final
+        # Attach all of the lagged columns in a single concatenation
+        return pd.concat([df, pd.DataFrame(lagged, index=df.index)], axis=1)
 
     def run(self):
         """Runs the feature engineering pipeline
         """
         try:
-            # Read the demand data from MongoDB
-            demand_data = self.read_mongo_data(self.demand_collection_name)
-            print("Successfully read demand data from MongoDB")
-            
-            # Read the temperature data from MongoDB
-            temperature_data = self.read_mongo_data(self.temperature_collection_name)
-            print("Successfully read temperature data from MongoDB")
-            
-            # Drop the location column from the temperature data
-            temperature_data.drop('LOCATION', axis=1, inplace=True)
+            # Index the source collections so the latest 'DATETIME' can be found, and temperatures joined, without scanning them
+            self.create_datetime_index(self.demand_collection_name)
+            self.create_datetime_index(self.temperature_collection_name)
             
-            # Take the average of temperature for each datetime and state
-            temperature_data = temperature_data.groupby(['state', 'DATETIME']).mean().reset_index()
+            # Read the demand data left joined with the average temperature on the 'DATETIME' and state columns by MongoDB,
+            # through the cache keyed on the contents of both collections. The instance holds the client, so it is left out of the key
+            df = self.memory.cache(self.read_demand_with_temperature, ignore=['self'])(
+                self.demand_collection_name,
+                self.temperature_collection_name,
+                (
+                    self.collection_version(self.demand_collection_name),
+                    self.collection_version(self.temperature_collection_name)
+                )
+            )
+            print("Successfully read demand and temperature data from MongoDB")
             
-            # Left join the demand and temperature data on the 'DATETIME' and state columns
-            df = pd.merge(demand_data, temperature_data, on=['state', 'DATETIME'], how='left')
+            # Store the states as categorical codes, refusing any state outside the categories rather than losing it as NaN
+            unknown_states = set(df['state'].dropna().unique()) - set(STATE_DTYPE.categories)
+            if unknown_states:
+                raise ValueError(f"Unknown states: {', '.join(sorted(unknown_states))}")
+            df['state'] = df['state'].astype(STATE_DTYPE)
             
-            # Fill in the missing temperature and demand values using an iterative imputer
-            df = self.impute_missing_values(df)
+            # Readings without a 'DATETIME' or state cannot be interpolated or have features built, so set them aside first
+            df = df[df['DATETIME'].notna().to_numpy() & df['state'].notna().to_numpy()]
             
-            # Convert the 'DATETIME' column to a datetime object
-            df['DATETIME'] = pd.to_datetime(df['DATETIME'])
+            # Fill in the missing temperature and demand values by interpolating over time
+            df = self.memory.cache(self.impute_missing_values, ignore=['self'])(df)
             
-            # Add additional features to the DataFrame
-            df['year'] = df['DATETIME'].dt.year
-            df['month'] = df['DATETIME'].dt.month.apply(lambda x: self.transform_periodic_values(x, 12))
-            df['day_of_month'] = df['DATETIME'].dt.day
-            df['day_of_week'] = df['DATETIME'].dt.dayofweek.apply(lambda x: self.transform_periodic_values(x, 7))
-            df['is_weekday'] = df['DATETIME'].dt.dayofweek < 5
-            df['period_of_day'] = df['DATETIME'].apply(lambda x: m.sin(2 * m.pi * ((x.hour * 2) + (x.minute // 30)) / 48))
-            df['is_public_holiday'] = df.apply(lambda x: self.is_public_holiday(x['DATETIME'], x['state']), axis=1)
-            df['is_daylight'] = df.apply(lambda x: self.is_daylight(x['DATETIME'], x['state']), axis=1)
+            # Add additional features to the DataFrame in a single step
+            df = df.assign(**self.build_features(df))
             
             # Add lagged features to the DataFrame
             df = self.add_lagged_features(df)
             
-            # Remove any rows with missing values
-            df.dropna(inplace=True)
+            # Remove any rows with missing values, masking the numeric columns in a single pass along with the keys
+            is_missing = (
+                df.select_dtypes(include='number').isna().to_numpy().any(axis=1)
+                | df['state'].isna().to_numpy()
+                | df['DATETIME'].isna().to_numpy()
+            )
             
-            # Remove duplicates
-            df.drop_duplicates(inplace=True)
+            # Remove duplicate readings in the same slice, hashing only the 'state' and 'DATETIME' keys rather than every feature
+            df = df[~is_missing].drop_duplicates(subset=['state', 'DATETIME'], ignore_index=True)
             
-            # If an output path is provided, write the transformed data to a CSV file
+            # If an output path is provided, write the transformed data to a Parquet or CSV file
             if self.local_output_path:
-                df.to_csv(self.local_output_path, index=False)
+                if self.local_output_path.endswith('.parquet'):
+                    df.to_parquet(
+                        self.local_output_path,
+                        engine='pyarrow',
+                        compression='zstd',
+                        row_group_size=PARQUET_ROW_GROUP_SIZE
+                    )
+                else:
+                    # Format the CSV from the Arrow columns in C++ rather than row by row in Python, writing 'DATETIME'
+                    # without fractional seconds so readers parsing '%Y-%m-%d %H:%M:%S' still get timestamps
+                    table = pa.Table.from_pandas(df, preserve_index=False)
+                    datetime_index = table.schema.get_field_index('DATETIME')
+                    datetimes = pc.cast(table['DATETIME'], pa.timestamp('s'), safe=False)
+                    table = table.set_column(
+                        datetime_index, 'DATETIME', pc.strftime(datetimes, format='%Y-%m-%d %H:%M:%S')
+                    )
+                    pacsv.write_csv(table, self.local_output_path)
                 print(f"Successfully wrote the transformed data to: {self.local_output_path}")
             
             # Otherwise, write the transformed data to a new collection in MongoDB
@@ -271,7 +388,7 @@ class FeatureEngineering:
                     self.drop_collection(self.target_collection_name)
                 
                 # Write the result to a new collection in MongoDB
-                self.db[self.target_collection_name].insert_many(df.to_dict(orient='records'))
+                self.insert_dataframe(self.target_collection_name, df)
                 print("Successfully wrote the transformed data to MongoDB")
             
         except Exception as e:
@@ -292,6 +409,7 @@ if __name__ == "__main__":
     TEMPERATURE_COLLECTION_NAME = 'temperature'
     TARGET_COLLECTION_NAME = 'features'
     LOCAL_OUTPUT_PATH = '/Users/dsartor/Repos/uni/Team-K---ZZSC9020-Capstone-Project/data/modelling_data.csv'
+    CACHE_DIRECTORY = '.cache'
     
     # Instantiate the class
     feature_engineering = FeatureEngineering(
@@ -300,7 +418,8 @@ if __name__ == "__main__":
         DEMAND_COLLECTION_NAME,
         TEMPERATURE_COLLECTION_NAME,
         TARGET_COLLECTION_NAME,
-        LOCAL_OUTPUT_PATH
+        LOCAL_OUTPUT_PATH,
+        CACHE_DIRECTORY
     )
     
     # Execute the pipeline
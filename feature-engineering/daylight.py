@@ -0,0 +1,90 @@
+"""
+This module determines whether datetimes fall during daylight hours in a given Australian state.
+"""
+
+import hashlib
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+# Define constants
+# Identifies this module's source, so cached results are recomputed whenever the calculation changes
+SOURCE_VERSION = hashlib.md5(Path(__file__).read_bytes()).hexdigest()
+
+# The latitude and longitude (degrees, north and east positive) of each state's capital city
+STATE_COORDINATES = {
+    'NSW': (-33.8688, 151.2093),
+    'QLD': (-27.4698, 153.0251),
+    'SA': (-34.9285, 138.6007),
+    'VIC': (-37.8136, 144.9631),
+}
+NS_PER_DAY = 86_400 * 10**9
+J2000_UNIX_DAY = 10_957.5
+AXIAL_TILT = np.radians(23.4397)
+SUNRISE_ELEVATION = np.radians(-0.833)
+
+
+def sun_times(days: np.ndarray, latitude: float, longitude: float) -> tuple:
+    """Calculates sunrise and sunset with the sunrise equation used by NOAA's solar calculator
+
+    Args:
+        days (np.ndarray): The days to calculate for, as whole days since the Unix epoch
+        latitude (float): The latitude of the location in degrees
+        longitude (float): The longitude of the location in degrees
+
+    Returns:
+        tuple: The sunrise and sunset times, as UTC nanoseconds since the Unix epoch
+    """
+    # Estimate the solar noon as days since the J2000 epoch (midday on 1 January 2000)
+    mean_noon = days + 0.5 - J2000_UNIX_DAY - longitude / 360
+
+    # Locate the sun on the ecliptic from the Earth's mean anomaly and the equation of the centre
+    anomaly = np.radians((357.5291 + 0.98560028 * mean_noon) % 360)
+    centre = 1.9148 * np.sin(anomaly) + 0.02 * np.sin(2 * anomaly) + 0.0003 * np.sin(3 * anomaly)
+    ecliptic_longitude = np.radians((np.degrees(anomaly) + centre + 180 + 102.9372) % 360)
+
+    # Correct the solar noon for the eccentricity of the orbit and the tilt of the axis
+    solar_noon = mean_noon + 0.0053 * np.sin(anomaly) - 0.0069 * np.sin(2 * ecliptic_longitude)
+
+    # Find the hour angle at which the sun crosses the horizon, allowing for refraction and its radius
+    declination = np.arcsin(np.sin(ecliptic_longitude) * np.sin(AXIAL_TILT))
+    latitude = np.radians(latitude)
+    cos_hour_angle = (np.sin(SUNRISE_ELEVATION) - np.sin(latitude) * np.sin(declination)) / (
+        np.cos(latitude) * np.cos(declination)
+    )
+    half_day = np.degrees(np.arccos(np.clip(cos_hour_angle, -1, 1))) / 360
+
+    # Convert the times from days since J2000 to nanoseconds since the Unix epoch
+    sunrise = ((solar_noon - half_day + J2000_UNIX_DAY) * NS_PER_DAY).astype(np.int64)
+    sunset = ((solar_noon + half_day + J2000_UNIX_DAY) * NS_PER_DAY).astype(np.int64)
+    return sunrise, sunset
+
+
+def compute_is_daylight(datetimes: pd.Series, states: pd.Series, version: str = None) -> np.ndarray:
+    """Determines which UTC datetimes are during daylight hours in their Australian state
+
+    Args:
+        datetimes (pd.Series): The UTC datetimes to check
+        states (pd.Series): The Australian state of each datetime
+        version (str, optional): The module version, only used to key the cache
+
+    Returns:
+        np.ndarray: Indicates if each datetime is during daylight hours
+    """
+    daylight = np.zeros(len(datetimes), dtype=bool)
+    utc_times = datetimes.to_numpy().astype('datetime64[ns]').astype(np.int64)
+
+    for state, (latitude, longitude) in STATE_COORDINATES.items():
+        mask = (states == state).to_numpy()
+        if not mask.any():
+            continue
+
+        # Number each datetime by its local solar day, which always contains a whole day of daylight
+        times = utc_times[mask]
+        days = (times + int(longitude / 360 * NS_PER_DAY)) // NS_PER_DAY
+
+        # Compare each datetime against the sunrise and sunset of its day as integers
+        sunrise, sunset = sun_times(days, latitude, longitude)
+        daylight[mask] = (sunrise < times) & (times < sunset)
+
+    return daylight
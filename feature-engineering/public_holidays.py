@@ -0,0 +1,64 @@
+"""
+This module determines whether datetimes fall on a public holiday in a given Australian state.
+"""
+
+import hashlib
+from pathlib import Path
+import holidays
+import numpy as np
+import pandas as pd
+
+# Define constants
+# Identifies this module's source and the holiday rules, so cached results are recomputed whenever either changes
+SOURCE_VERSION = (hashlib.md5(Path(__file__).read_bytes()).hexdigest(), holidays.__version__)
+
+# Public holiday dates for each (state, year), shared by every caller in the process
+HOLIDAY_CACHE = {}
+
+
+def holidays_for(state: str, years: list) -> pd.DatetimeIndex:
+    """Gets the public holidays in a given state, building each (state, year) calendar only once
+
+    Args:
+        state (str): The Australian state to get holidays for
+        years (list): The years to get holidays for
+
+    Returns:
+        pd.DatetimeIndex: The dates of the public holidays
+    """
+    # Build the calendar for any years that have not been cached yet
+    missing_years = [year for year in years if (state, year) not in HOLIDAY_CACHE]
+    if missing_years:
+        calendar = holidays.AU(subdiv=state, years=missing_years)
+        for year in missing_years:
+            HOLIDAY_CACHE[(state, year)] = {date for date in calendar if date.year == year}
+
+    return pd.DatetimeIndex(sorted(set().union(*(HOLIDAY_CACHE[(state, year)] for year in years))))
+
+
+def compute_is_public_holiday(datetimes: pd.Series, states: pd.Series, version: tuple = None) -> np.ndarray:
+    """Determines which datetimes fall on a public holiday in their Australian state
+
+    Args:
+        datetimes (pd.Series): The datetimes to check
+        states (pd.Series): The Australian state of each datetime
+        version (tuple, optional): The module version, only used to key the cache
+
+    Returns:
+        np.ndarray: Indicates if each datetime is a public holiday
+    """
+    # Truncate the datetimes to midnight so they can be matched against whole-day holidays
+    dt = datetimes.dt
+    years = dt.year.unique().tolist()
+    dates = dt.normalize()
+    is_holiday = np.zeros(len(datetimes), dtype=bool)
+
+    for state in states.dropna().unique():
+        # Get the holiday calendar for the years present in the data
+        state_holidays = holidays_for(state, years)
+
+        # Look up the state's dates against the calendar using pandas' hashtable
+        mask = (states == state).to_numpy()
+        is_holiday[mask] = dates[mask].isin(state_holidays)
+
+    return is_holiday